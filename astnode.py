@@ -16,39 +16,67 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-class BaseNode: pass
+class BaseNode:
+    # empty __slots__ so that the nodes don't get a __dict__
+    __slots__ = ()
+
+def make_init(slots):
+    """Generates an __init__ method that assigns the given slots."""
+    # the generated code looks like this:
+    # def __init__(self, line, left=None, right=None):
+    #     self.line = line
+    #     self.left = left
+    #     self.right = right
+    # which is a lot faster than going through **values and setattr
+    src = "def __init__(self, line{}):\n    self.line = line\n".format(
+        "".join(", {}=None".format(slot) for slot in slots))
+    src += "".join("    self.{0} = {0}\n".format(slot) for slot in slots)
+    namespace = {}
+    exec(src, namespace)
+    return namespace["__init__"]
+
+def repr_parts(value, parts):
+    """Appends the repr of value to parts piece by piece."""
+    if isinstance(value, BaseNode):
+        parts.append("(" + value.__class__.__name__ + " ")
+        sep = ""
+        for slot in value.fields:
+            attr = getattr(value, slot, None)
+            if attr is None: continue
+            parts.append(sep)
+            repr_parts(attr, parts)
+            sep = " "
+        parts.append(")")
+    elif isinstance(value, list):
+        parts.append("(list ")
+        sep = ""
+        for item in value:
+            parts.append(sep)
+            repr_parts(item, parts)
+            sep = " "
+        parts.append(")")
+    else:
+        parts.append(repr(value))
+
+def node_repr(node):
+    """A generic __repr__ method for the nodes."""
+    # the whole tree is collected into one list and joined once,
+    # instead of every node joining the reprs of its children
+    parts = []
+    repr_parts(node, parts)
+    return "".join(parts)
 
 def node(node_type, slots):
     """Creates a new node type object."""
-    def node_init(self, line, **values):
-        """A generic initializer for the nodes."""
-        self.line = line
-        # __slots__ instead of __dict__ so have to use setattr
-        for attr, value in values.items():
-            setattr(self, attr, value)
-
-    def node_repr(node):
-        """A generic __repr__ method for the nodes."""
-        s = "(" + node.__class__.__name__ + " "
-        slot_reprs = []
-        for slot in node.__slots__:
-            if slot == "line": continue
-            attr = getattr(node, slot, None)
-            if attr is None:
-                continue
-            elif isinstance(attr, list):
-                reprlist = map(repr, attr)
-                slot_reprs.append("(list " + " ".join(reprlist) + ")")
-            else:
-                slot_reprs.append(repr(attr))
-        s += " ".join(slot_reprs) + ")"
-        return s
+    slots = slots.split()
 
     # construct a new type and return it
     # "line" will be appended to __slots__ automatically
     return type(node_type, (BaseNode,), {
-        "__init__": node_init,
-        "__slots__": slots.split() + ["line"],
+        "__init__": make_init(slots),
+        "__slots__": slots + ["line"],
+        # the slots without "line", precomputed for __repr__
+        "fields": tuple(slots),
         "__repr__": node_repr})
 
 
@@ -16,15 +16,22 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import re
+import sys
+from functools import lru_cache
+from types import MappingProxyType
 
 class LexerException(Exception):
     def __init__(self, msg, line):
         super().__init__("{}: lexer: {}".format(line, msg))
 
 
-class Token(object):
+class Token:
+    __slots__ = ("type", "value", "line")
+
     def __init__(self, token_type, value, line):
-        self.type = token_type
+        # interned so that comparing types against the (also interned)
+        # string constants in the parser is mostly just an identity check
+        self.type = sys.intern(token_type)
         self.value = value
         self.line = line
         # line information is used by later passes in the compiler
@@ -42,7 +49,7 @@ class Token(object):
         return "line {}: {}\t '{}'".format(self.line, self.type, self.value)
 
 
-class Lexer(object):
+class Lexer:
     # a semi-generic regex for matching a token
     # this will handle:
     # - whitespace characters and comments
@@ -55,9 +62,11 @@ class Lexer(object):
         (?: [#] [^\n]* \n \s*)*
 
         # actual tokens
-        (
+        # the only capturing groups are the named ones,
+        # so that Match.lastgroup tells which one matched
+        (?:
         # strings
-        \" (?P<str>(\\.|[^\\\"])*) \" (?=\W) |
+        \" (?P<str>(?:\\.|[^\\\"])*) \" (?=\W) |
 
         # hex integer literals
         (?P<hex>0x[0-9a-fA-F]+) (?=\W) |
@@ -74,49 +83,122 @@ class Lexer(object):
     """
 
     def __init__(self, userdefined):
-        s = ""
-        # go over the dict of user defined tokens
-        for k, v in userdefined.items():
-            # key: token group, value: list of what to match
-            # escape the values
-            escaped = [re.escape(val) for val in v]
-            # join into a named regex pattern
-            s += "(?P<{}>{}) |".format(k, "|".join(escaped))
-
-        # format into the generic regex
-        r = Lexer.regex.format(s)
-
-        # compile the pattern to avoid overhead
-        # since it will be used so many times
-        self.pattern = re.compile(r, re.VERBOSE | re.MULTILINE)
+        # building and compiling the pattern is cached,
+        # so lexers with the same user defined tokens share it
+        self.pattern, self.keywords = build_pattern(freeze(userdefined))
 
     def tokenize(self, src):
+        """Returns a list of the tokens in src."""
+        tokens = []
         pos = 0
         line = 1
-        while True:
-            m = self.pattern.match(src, pos)
-            # no match
-            if not m: break
-            # keep track of position
-            pos = m.end()
+        keywords = self.keywords
+        # finditer keeps the whole scan inside the regex engine
+        for m in self.pattern.finditer(src):
+            # unlike repeated match() calls, finditer skips over input
+            # it can't match, so stop at the first gap like before
+            if m.start() != pos: break
             # count newlines in the matched portion of the source
-            line += src[m.start():m.end()].count("\n")
-
-            for k, v in m.groupdict().items():
-                if v is not None:
-                    # fix some names
-                    if k == "hex":
-                        v = int(v, 16)
-                        k = "int"
-                    elif k == "int":
-                        v = int(v)
-                    elif k == "atom":
-                        # this makes parsing easier
-                        k = v
-
-                    yield Token(k, v, line)
-
-                    # since there should be only one group that matches
-                    # we can safely break out of iterating the groupdict
-                    break
+            # (without slicing it out, which would copy it)
+            end = m.end()
+            line += src.count("\n", pos, end)
+            # keep track of position
+            pos = end
+
+            # there should be only one group that matches
+            k = m.lastgroup
+            v = m.group(k)
+
+            if k == "id":
+                # identifier or keyword
+                k = keywords.get(v, k)
+
+            # fix some names
+            if k == "hex":
+                v = int(v, 16)
+                k = "int"
+            elif k == "int":
+                v = int(v)
+            elif k == "atom":
+                # this makes parsing easier
+                k = v
+
+            tokens.append(Token(k, v, line))
 
+        return tokens
+
+
+def freeze(userdefined):
+    """Converts the user defined token dict into a hashable form."""
+    # order is kept, since it matters for the regex alternation
+    return tuple((k, tuple(v)) for k, v in userdefined.items())
+
+def trie_regex(words):
+    """Builds a regex that matches the longest of words.
+
+    The words are put into a trie first, so e.g. [">", ">>", ">>>", ">="]
+    becomes >(?:>(?:>)?|=)? and the regex engine never has to go back to
+    try another word with the same prefix.
+    """
+    trie = {}
+    for word in words:
+        t = trie
+        for c in word:
+            t = t.setdefault(c, {})
+        # marks the end of a word
+        t[""] = None
+    return trie_node_regex(trie)
+
+def trie_node_regex(t):
+    """Converts a trie node built by trie_regex into a regex."""
+    alternatives = [re.escape(c) + trie_node_regex(child)
+        for c, child in t.items() if c != ""]
+    if not alternatives:
+        return ""
+    if len(alternatives) == 1 and "" not in t:
+        return alternatives[0]
+    r = "(?:" + "|".join(alternatives) + ")"
+    if "" in t:
+        # a word may end here; ? is greedy, so the longest match wins
+        r += "?"
+    return r
+
+def build_source(userdefined):
+    """Builds the regex source and keyword table for a Lexer.
+
+    userdefined is the user defined token dict frozen with freeze().
+    """
+    s = ""
+    # keywords are matched as identifiers and then looked up here,
+    # like lex does it; this way the longest match always wins
+    # (e.g. "whilex" is an identifier, not "while" followed by "x")
+    keywords = {}
+    # go over the user defined tokens
+    for k, v in userdefined:
+        # key: token group, value: list of what to match
+        symbols = []
+        for val in v:
+            if val.isidentifier():
+                keywords[val] = k
+            else:
+                symbols.append(val)
+        if not symbols: continue
+        # join into a named regex pattern
+        s += "(?P<{}>{}) |".format(k, trie_regex(symbols))
+
+    # format into the generic regex
+    return Lexer.regex.format(s), keywords
+
+@lru_cache(maxsize=None)
+def build_pattern(userdefined):
+    """Compiles the regex pattern and builds the keyword table for a Lexer.
+
+    userdefined is the user defined token dict frozen with freeze().
+    """
+    r, keywords = build_source(userdefined)
+    # compile the pattern to avoid overhead
+    # since it will be used so many times
+    # the keyword table is shared by every Lexer made from equal input,
+    # so it is handed out read-only
+    return (re.compile(r, re.VERBOSE | re.MULTILINE),
+        MappingProxyType(keywords))
@@ -24,8 +24,9 @@ import typecheck
 
 userdefined = {
     # "atoms" which don't have any special value
-    "atom": ["while", "if", "else", "return", "struct", "sizeof"]
-        + [">>>", ">>", "<<", "<", ">" "<=", ">=", "!=", "=="]
+    "atom": ["while", "if", "else", "break", "continue", "return",
+        "struct", "sizeof"]
+        + [">>>", ">>", "<<", "<", ">", "<=", ">=", "!=", "=="]
         + list("(){}*/+-~|&^=<>,.;"),
 }
 
@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import sys
+
 from lexer import Token
 import astnode as node
 
@@ -24,37 +26,85 @@ class ParserException(Exception):
         super().__init__("{}: parser: {}".format(line, msg))
 
 
-class Lookahead(object):
-    def __init__(self, gen, default):
-        self.peek = next(gen, default)
-        self.gen = gen
+class Lookahead:
+    __slots__ = ("peek", "tokens", "pos", "default")
+
+    def __init__(self, tokens, default):
+        # tokens is a list, default is used after the last token
+        self.tokens = tokens
+        self.pos = 0
         self.default = default
+        self.peek = tokens[0] if tokens else default
 
-    def next(self, count=1):
-        while count > 0:
-            a = self.peek
-            self.peek = next(self.gen, self.default)
-            count -= 1
+    def next(self):
+        """Consumes and returns the next token."""
+        a = self.peek
+        pos = self.pos + 1
+        self.pos = pos
+        try:
+            self.peek = self.tokens[pos]
+        except IndexError:
+            # only happens at the end of the input
+            self.peek = self.default
         return a
 
 
-def expect(tok, *expects):
+def interned(ops):
+    """Returns ops with each operator string passed through sys.intern.
+
+    Token types are interned the same way (see lexer.Token), so that
+    looking a token type up in these tables is an identity check; single
+    character and identifier-like strings (all the other types the
+    parser compares against) are interned already.
+    """
+    if isinstance(ops, dict):
+        return {sys.intern(op): v for op, v in ops.items()}
+    return frozenset(map(sys.intern, ops))
+
+# binary operators and their precedences, higher binds tighter
+binary_ops = interned({
+    "+": 1, "-": 1,
+    "*": 2, "/": 2,
+    ">>>": 3, ">>": 3, "<<": 3,
+    "&": 4, "|": 4, "^": 4,
+})
+
+# prefix operators
+unary_ops = interned(("-", "~", "*", "&", "sizeof"))
+
+# comparison operators for conditions
+condition_ops = interned(("==", "!=", "<=", ">=", "<", ">"))
+
+# what can follow an item in an argument list
+list_ends = frozenset((",", ")"))
+
+
+def expect(tok, expected):
+    # every caller expects a single type, see expect_set for more
     t = tok.next()
-    if t in expects:
+    if t.type == expected:
         return t
-    msg = " or ".join(expects)
-    raise ParserException("expected {}".format(msg), t.line)
+    raise ParserException("expected {}".format(expected), t.line)
+
+def expect_set(tok, accepted, what):
+    """Like expect, but with a precomputed set of accepted types."""
+    t = tok.next()
+    if t.type in accepted:
+        return t
+    raise ParserException("expected {}".format(what), t.line)
 
 def parse_program(tok):
     structs = []
     funcs = []
-    while tok.peek != "eof":
-        if tok.peek == "struct":
+    kind = tok.peek.type
+    while kind != "eof":
+        if kind == "struct":
             s = parse_struct(tok)
             structs.append(s)
         else:
             f = parse_function(tok)
             funcs.append(f)
+        kind = tok.peek.type
     return funcs, structs
 
 def parse_struct(tok):
@@ -62,248 +112,257 @@ def parse_struct(tok):
     name = expect(tok, "id")
     expect(tok, "{")
     decllist = []
-    while tok.peek == "id":
+    append = decllist.append
+    while tok.peek.type == "id":
         member_type, member_name = parse_vardecl(tok)
         line = expect(tok, ";").line
-        decl = node.VarDeclStatement(line, type=member_type, name=member_name)
-        decllist.append(decl)
+        append(node.VarDeclStatement(line, member_type, member_name))
     expect(tok, "}")
-    return node.Struct(t.line, name=name.value, decls=decllist)
+    return node.Struct(t.line, name.value, decllist)
 
 def parse_function(tok):
     ret_type, name = parse_vardecl(tok)
     t = expect(tok, "(")
     arglist = []
-    if tok.peek != ")":
+    append = arglist.append
+    if tok.peek.type != ")":
         while True:
             type, name = parse_vardecl(tok)
-            arglist.append(node.VarDeclStatement(t.line, type=type, name=name))
-            if expect(tok, ",", ")") == ")":
+            append(node.VarDeclStatement(t.line, type, name))
+            if expect_set(tok, list_ends, ", or )").type == ")":
                 break
     else:
         tok.next()
 
     # parse function body
-    stmt = parse_statement(tok)
-    return node.Func(t.line, type=ret_type, name=name, args=arglist, stmt=stmt)
+    stmt = parse_body(tok)
+    return node.Func(t.line, ret_type, name, arglist, stmt)
 
 def parse_vardecl(tok, t = None):
     # doesn't produce a valid ast node!
     if t == None:
         t = expect(tok, "id")
     ptr_level = 0
-    while tok.peek == "*":
+    while tok.peek.type == "*":
         ptr_level += 1
         tok.next()
     name = expect(tok, "id")
-    return node.Type(t.line, type=t.value, level=ptr_level), name.value
+    return node.Type(t.line, t.value, ptr_level), name.value
 
 def parse_fcall(tok, t):
     # this doesn't accept normal input!
     # skip over (
     tok.next()
     arglist = []
-    if tok.peek != ")":
+    append = arglist.append
+    if tok.peek.type != ")":
         while True:
-            arg = parse_expression(tok)
-            arglist.append(arg)
-            if expect(tok, ")", ",") == ")":
+            append(parse_expression(tok))
+            if expect_set(tok, list_ends, ", or )").type == ")":
                 break
-    return node.FCallStatement(t.line, name=t.value, args=arglist)
+    return node.FCallStatement(t.line, t.value, arglist)
 
 def parse_block(tok):
     t = expect(tok, "{")
     stmt_list = []
-    while tok.peek != "}":
-        s = parse_statement(tok)
-        if isinstance(s, tuple):
-            # in case multiple statements are returned
-            stmt_list.extend(s)
-        else:
-            stmt_list.append(s)
+    extend = stmt_list.extend
+    while tok.peek.type != "}":
+        extend(parse_statement(tok))
     tok.next() # skip }
-    return node.BlockStatement(t.line, stmts=stmt_list)
+    return node.BlockStatement(t.line, stmt_list)
 
 def parse_if(tok):
     else_body = None
     t = expect(tok, "if")
     cond = parse_condition(tok)
-    body = parse_statement(tok)
-    if tok.peek == "else":
-        else_body = parse_statement(tok)
-    return node.IfStatement(t.line, cond=cond, stmt=body, elsestmt=else_body)
+    body = parse_body(tok)
+    if tok.peek.type == "else":
+        tok.next()
+        else_body = parse_body(tok)
+    return node.IfStatement(t.line, cond, body, else_body)
 
 def parse_while(tok):
     t = expect(tok, "while")
     cond = parse_condition(tok)
-    body = parse_statement(tok)
-    return node.WhileStatement(t.line, cond=cond, stmt=body)
+    body = parse_body(tok)
+    return node.WhileStatement(t.line, cond, body)
 
-def parse_statement(tok):
-    if tok.peek == "{":
-        return parse_block(tok)
-    elif tok.peek == "if":
-        return parse_if(tok)
-    elif tok.peek == "while":
-        return parse_while(tok)
-    elif tok.peek == "break":
-        t = tok.next()
-        expect(tok, ";")
-        return node.CtrlStatement(t.line, op="break")
-    elif tok.peek == "continue":
-        t = tok.next()
+def parse_body(tok):
+    """Parses a statement that has to be a single node."""
+    stmts = parse_statement(tok)
+    if len(stmts) == 1:
+        return stmts[0]
+    # declaration with an initializer, keep it in its own scope
+    return node.BlockStatement(stmts[0].line, list(stmts))
+
+def parse_break(tok):
+    t = expect(tok, "break")
+    expect(tok, ";")
+    return node.CtrlStatement(t.line, "break")
+
+def parse_continue(tok):
+    t = expect(tok, "continue")
+    expect(tok, ";")
+    return node.CtrlStatement(t.line, "cont")
+
+def parse_return(tok):
+    t = expect(tok, "return")
+    expr = parse_expression(tok)
+    expect(tok, ";")
+    return node.RetStatement(t.line, expr)
+
+def parse_store(tok):
+    # memory store
+    ptr_level = 0
+    while tok.peek.type == "*":
+        ptr_level += 1
+        tok.next()
+    factor = parse_factor(tok)
+    t = expect(tok, "=")
+    expr = parse_expression(tok)
+    expect(tok, ";")
+    return node.StoreStatement(t.line, ptr_level, factor, expr)
+
+def parse_id_statement(tok):
+    # variable declaration, function call or assignment
+    # returns a tuple like parse_statement
+    i = expect(tok, "id")
+    if tok.peek.type in ("id", "*"):
+        # variable declaration
+        type, name = parse_vardecl(tok, i)
+        # no initialization by default
+        assign = None
+        if tok.peek.type == "=":
+            tok.next()
+            init = parse_expression(tok)
+            assign = node.AssignStatement(i.line, name, init)
         expect(tok, ";")
-        return node.CtrlStatement(t.line, op="cont")
-    elif tok.peek == "return":
-        t = tok.next()
-        expr = parse_expression(tok)
+
+        decl = node.VarDeclStatement(i.line, type, name)
+        if assign: return decl, assign
+        return (decl,)
+    elif tok.peek.type == "(":
+        # function call
+        f = parse_fcall(tok, i)
         expect(tok, ";")
-        return node.RetStatement(t.line, value=expr)
-    elif tok.peek == "*":
-        # memory store
-        ptr_level = 0
-        while tok.peek == "*":
-            ptr_level += 1
-            tok.next()
-        factor = parse_factor(tok)
+        return (f,)
+    else:
+        # assignment or error
+        s = i.value
+        struct = False
+        if tok.peek.type == ".":
+            s = parse_struct_access(tok, i)
+            # stuct member store
+            struct = True
         t = expect(tok, "=")
         expr = parse_expression(tok)
         expect(tok, ";")
-        return node.StoreStatement(t.line, level=ptr_level, ptr=factor, value=expr)
-    else:
-        # variable declaration, function call or assignment
-        i = expect(tok, "id")
-        if tok.peek.type in ("id", "*"):
-            # variable declaration
-            type, name = parse_vardecl(tok, i)
-            # no initialization by default
-            assign = None
-            if tok.peek == "=":
-                tok.next()
-                init = parse_expression(tok)
-                assign = node.AssignStatement(i.line, var=name, value=init)
-            expect(tok, ";")
-            
-            decl = node.VarDeclStatement(i.line, type=type, name=name)
-            if assign: return decl, assign
-            return decl
-        elif tok.peek == "(":
-            # function call
-            f = parse_fcall(tok, i)
-            expect(tok, ";")
-            return f
+        if struct:
+            return (node.StructStoreStatement(t.line, s, expr),)
         else:
-            # assignment or error
-            s = i.value
-            struct = False
-            if tok.peek == ".":
-                s = parse_struct_access(tok, i)
-                # stuct member store
-                struct = True
-            t = expect(tok, "=")
-            expr = parse_expression(tok)
-            expect(tok, ";")
-            if struct:
-                return node.StructStoreStatement(t.line, struct=s, value=expr)
-            else:
-                return node.AssignStatement(t.line, var=s, value=expr)
+            return (node.AssignStatement(t.line, s, expr),)
+
+# statements that can be told apart by their first token,
+# the rest start with an identifier
+statement_parsers = {
+    "{": parse_block,
+    "if": parse_if,
+    "while": parse_while,
+    "break": parse_break,
+    "continue": parse_continue,
+    "return": parse_return,
+    "*": parse_store,
+}
+
+def parse_statement(tok):
+    # returns a tuple, since a declaration with an initializer
+    # is split into two statements
+    handler = statement_parsers.get(tok.peek.type)
+    if handler is None:
+        return parse_id_statement(tok)
+    return (handler(tok),)
 
 def parse_condition(tok):
-    ops = ("==", "!=", "<=", ">=", "<", ">")
     left = parse_expression(tok)
-    op = expect(tok, *(ops))
+    op = expect_set(tok, condition_ops, "a comparison operator")
     right = parse_expression(tok)
-    return node.Condition(op.line, op=op.type, left=left, right=right)
-
-def parse_expression(tok):
-    ops = ("+", "-")
-    ret = parse_mult(tok)
-    while tok.peek.type in ops:
-        t = tok.next()
-        right = parse_mult(tok)
-        ret = node.BinaryOp(t.line, op=t.type, left=ret, right=right)
-    return ret
-
-def parse_mult(tok):
-    ops = ("*", "/")
-    ret = parse_shift(tok)
-    while tok.peek.type in ops:
-        t = tok.next()
-        right = parse_shift(tok)
-        ret = node.BinaryOp(t.line, op=t.type, left=ret, right=right)
-    return ret
+    return node.Condition(op.line, op.type, left, right)
 
-def parse_shift(tok):
-    ops = (">>>", ">>", "<<")
-    ret = parse_bitwise(tok)
-    while tok.peek.type in ops:
-        t = tok.next()
-        right = parse_unary(tok)
-        ret = node.BinaryOp(t.line, op=t.type, left=ret, right=right)
-    return ret
-
-def parse_bitwise(tok):
-    ops = ("&", "|", "^")
+def parse_expression(tok, min_prec=1):
+    # precedence climbing instead of one function per precedence level
+    # (see binary_ops), so that parsing a lone factor doesn't have to go
+    # through a call for every level
     ret = parse_unary(tok)
-    while tok.peek.type in ops:
-        t = tok.next()
-        right = parse_unary(tok)
-        ret = node.BinaryOp(t.line, op=t.type, left=ret, right=right)
+    t = tok.peek
+    prec = binary_ops.get(t.type, 0)
+    while prec >= min_prec:
+        tok.next()
+        # all binary operators are left associative
+        right = parse_expression(tok, prec + 1)
+        ret = node.BinaryOp(t.line, t.type, ret, right)
+        t = tok.peek
+        prec = binary_ops.get(t.type, 0)
     return ret
 
 def parse_unary(tok):
-    ops = ("-", "~", "*", "&", "sizeof")
-    if tok.peek.type not in ops:
+    t = tok.peek
+    op = t.type
+    if op not in unary_ops:
         return parse_factor(tok)
 
-    t = tok.next()
+    tok.next()
+    # fold repeated operators into one node
     level = 1
-    while tok.peek == t:
-        if t == "sizeof":
+    while tok.peek.type == op:
+        if op == "sizeof":
             raise ParserException("sizeof sizeof not supported", t.line)
+        tok.next()
         level += 1
 
-    if t in ("-", "~") and level % 2 == 0:
+    # the operand may start with a different prefix operator
+    factor = parse_unary(tok)
+    if op in ("-", "~"):
         # double inversion, double negation cancel out
-        return parse_factor(tok)
-
-    factor = parse_factor(tok)
-    if t in ("*", "&", "sizeof"):
-        return node.PointerOp(t.line, op=t.type, right=factor, level=level)
+        if level % 2 == 0:
+            return factor
+        return node.UnaryOp(t.line, op, factor)
     else:
-        return node.UnaryOp(t.line, op=t.type, right=factor)
+        return node.PointerOp(t.line, op, factor, level)
 
 def parse_factor(tok):
     t = tok.next()
-    if t == "(":
-        expr = parse_expression(tok)
-        expect(tok, ")")
-        return expr
-    elif t == "int":
-        return node.ILiteral(t.line, value=t.value)
-    elif t == "id":
-        if tok.peek == "(":
+    kind = t.type
+    # most common first
+    if kind == "id":
+        after = tok.peek.type
+        if after == "(":
             return parse_fcall(tok, t)
-        elif tok.peek == ".":
+        elif after == ".":
             return parse_struct_access(tok, t)
         else:
-            return node.Variable(t.line, name=t.value)
-    elif t == "str":
-        return node.SLiteral(t.line, value=t.value)
+            return node.Variable(t.line, t.value)
+    elif kind == "int":
+        return node.ILiteral(t.line, t.value)
+    elif kind == "(":
+        expr = parse_expression(tok)
+        expect(tok, ")")
+        return expr
+    elif kind == "str":
+        return node.SLiteral(t.line, t.value)
     else:
         raise ParserException("expected a factor", t.line)
 
 def parse_struct_access(tok, t):
     # struct member access
-    ret = None
-    while tok.peek == ".":
+    # the callers have already checked that there is a "." after t
+    tok.next()
+    n = expect(tok, "id")
+    ret = node.StructAccess(t.line, t.value, n.value)
+    while tok.peek.type == ".":
         tok.next()
         n = expect(tok, "id")
-        if ret is None:
-            ret = node.StructAccess(t.line, left=t.value, right=n.value)
-        else:
-            # left associative => left recursive tree
-            ret = node.StructAccess(n.line, left=ret, right=n.value)
+        # left associative => left recursive tree
+        ret = node.StructAccess(n.line, ret, n.value)
     return ret
 
 def parse(tokens):
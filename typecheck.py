@@ -15,8 +15,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from functools import singledispatch
-from copy import copy
+import sys
+
 import astnode
 
 
@@ -29,101 +29,225 @@ builtin_types = {"u0": 0,
     "i8": 1, "i16": 2, "i32": 4, "i64": 8}
 pointer_size = 8
 
+def known_types(structs):
+    """Returns a set of all type names: the builtins and the structs."""
+    return frozenset(builtin_types).union(structs)
+
 def check_structs(structs):
-    struct_names = [s.name for s in structs]
-    struct_dict = {name: struct for name, struct in zip(struct_names, structs)}
+    struct_dict = {}
+    for struct in structs:
+        if struct.name in struct_dict:
+            raise SemanticsException(struct.line,
+                "struct ", struct.name, " defined twice")
+        struct_dict[struct.name] = struct
+    types = known_types(struct_dict)
     for struct in structs:
-        check(struct, struct_dict)
+        check(struct, types)
+    # all structs are checked before any is expanded, since expanding
+    # a struct also expands the structs nested in it
+    table = member_types(struct_dict)
+    for struct in structs:
+        expand_struct(struct, table)
     return struct_dict
 
 def check_funcs(funcs, structs):
+    types = known_types(structs)
+    # type keys for this compilation, see type_key
+    type_cache = {}
     for func in funcs:
-        check(func, funcs, structs)
+        check(func, funcs, structs, types, type_cache)
+
+# check functions for each node type, see register
+# a plain dict lookup on the exact type is cheaper than singledispatch,
+# and the node types don't inherit from each other anyway
+check_handlers = {}
+
+def register(node_type):
+    """Registers the decorated function as the check for node_type."""
+    def decorator(func):
+        check_handlers[node_type] = func
+        return func
+    return decorator
 
-@singledispatch
 def check(node, *args):
-    print("Generic check function, type", node.__class__.__name__)
-    print("Node is", node)
-    print("My arguments are", args)
+    return check_handlers.get(node.__class__, check_generic)(node, *args)
+
+def check_generic(node, *args):
+    # a missing handler is a bug in the checker, not in the program
+    # being compiled; with python -O this is skipped over silently
+    if __debug__:
+        raise TypeError("no check handler for " + node.__class__.__name__)
+
+def find_duplicate(decls):
+    """Returns the first declaration with an already used name, or None."""
+    names = [decl.name for decl in decls]
+    # fast path, no duplicates
+    if len(set(names)) == len(names):
+        return None
+    seen = set()
+    for decl in decls:
+        if decl.name in seen:
+            return decl
+        seen.add(decl.name)
+
+def field_at(decl, name, offset):
+    """Returns a copy of a struct member with a new name and offset."""
+    # a direct constructor call is a lot cheaper than copy.copy
+    return astnode.VarDeclStatement(decl.line, decl.type, name, offset)
+
+def member_types(structs):
+    """Returns a dict from type names to sizes (builtins) or structs.
+
+    A struct with the same name as a builtin type doesn't replace it.
+    """
+    table = dict(structs)
+    table.update(builtin_types)
+    return table
+
+def expand_struct(struct, types, scope=frozenset()):
+    """Expands a struct definition and checks for recursive definitions.
 
-def expand_struct(struct, structs, scope=set(), size=0):
-    """Expands a struct definition and checks for recursive definitions."""
+    types is a dict made with member_types. The expanded fields and the
+    size are stored in the struct itself, so a struct nested in many
+    others is only expanded once.
+    """
+    if struct.size is not None:
+        # already expanded
+        return
     newdecls = []
-    scope.add(struct.name)
+    # globals and methods used in the loop, bound to locals once
+    append = newdecls.append
+    new_field = field_at
+    intern = sys.intern
+    ptr_size = pointer_size
+    size = 0
+    # structs being expanded further up, a new set for each level
+    # (a mutable default would be shared between all calls)
+    scope = scope | {struct.name}
     for decl in struct.decls:
-        decl.soffset = size
-        if decl.type.level > 0:
-            size += pointer_size
-            newdecls.append(copy(decl))
+        decl_type = decl.type
+        if decl_type.level > 0:
+            append(new_field(decl, decl.name, size))
+            size += ptr_size
             continue
-        elif decl.type.type in scope:
-            raise SemanticsException(decl.line, "recursive struct definition")
-        elif decl.type.type in builtin_types:
-            size += builtin_types[decl.type.type]
-            newdecls.append(copy(decl))
-        elif decl.type.type in structs:
-            size, fields = expand_struct(structs[decl.type.type], structs, scope, size)
-            # correct names
-            for field in fields:
-                field.name = decl.name + "." + field.name
-            newdecls.extend(fields)
+        typename = decl_type.type
+        if typename in scope:
+            raise SemanticsException(decl.line,
+                "recursive struct definition")
+        # one lookup tells builtins, structs and unknown types apart
+        member_type = types.get(typename)
+        if member_type.__class__ is int:
+            append(new_field(decl, decl.name, size))
+            size += member_type
+        elif member_type is not None:
+            expand_struct(member_type, types, scope)
+            # copy the nested fields, correcting names and offsets
+            prefix = decl.name + "."
+            for field in member_type.decls:
+                # interned, since these are looked up by name later on
+                name = intern(prefix + field.name)
+                append(new_field(field, name, size + field.soffset))
+            size += member_type.size
         else:
-            type_exists(decl)
+            type_exists(typename, types, decl.line)
             # this should be unreachable
             raise RuntimeError("unreachable code")
-    scope.remove(struct.name)
-    return size, newdecls
+    struct.size = size
+    # set the expanded fields
+    struct.decls = newdecls
 
-@check.register(astnode.Struct)
-def check_struct(struct, structs):
+@register(astnode.Struct)
+def check_struct(struct, types):
     """Checks for duplicate member names and performs type checking."""
-    names = set()
+    duplicate = find_duplicate(struct.decls)
+    if duplicate is not None:
+        raise SemanticsException(duplicate.line,
+            "struct member ", duplicate.name, " defined twice")
     for decl in struct.decls:
-        if decl.name in names:
-            raise SemanticsException(decl.line,
-                "struct member ", decl.name, " defined twice")
-        names.add(decl.name)
-        check(decl, structs)
+        check(decl, types)
 
-    struct.size, fields = expand_struct(struct, structs)
-    # set the expanded fields
-    struct.decls = fields
+def type_key(t, type_cache):
+    """Returns the canonical (type, level) key for the Type node t.
+
+    Type nodes don't define __eq__, so two nodes for the same type never
+    compare equal. Keys taken from the same type_cache are the same
+    object for the same type, so they can be compared with is. The node
+    itself is left alone and keeps its own line.
+    """
+    key = (t.type, t.level)
+    return type_cache.setdefault(key, key)
+
+@register(astnode.VarDeclStatement)
+def check_vardecl(decl, types, type_cache=None, scope=frozenset()):
+    """Wrapper for type_exists.
 
-@check.register(astnode.VarDeclStatement)
-def check_vardecl(decl, structs):
-    """Wrapper for type_exists."""
-    type_exists(decl.type.type, structs, decl.line)
+    type_cache and scope are passed in by check_block, but not used yet.
+    """
+    type_exists(decl.type.type, types, decl.line)
 
-def type_exists(typename, structs, line):
-    """Checks for undefined types."""
-    if not (typename in structs or typename in builtin_types):
+def type_exists(typename, types, line):
+    """Checks for undefined types.
+
+    types is the set of all type names, see known_types.
+    """
+    if typename not in types:
         raise SemanticsException(line,
             "type ", typename, " not found")
 
-@check.register(astnode.Func)
-def check_func(func, funcs, structs):
+@register(astnode.Func)
+def check_func(func, funcs, structs, types, type_cache):
     # check if the return type is valid
-    type_exists(func.type.type, structs, func.line)
-    argnames = set()
+    type_exists(func.type.type, types, func.line)
+    ret_type = type_key(func.type, type_cache)
+    duplicate = find_duplicate(func.args)
+    if duplicate is not None:
+        raise SemanticsException(duplicate.line,
+            "function argument ", duplicate.name, " defined twice")
     for arg in func.args:
-        if arg.name in argnames:
-            raise SemanticsException(arg.line,
-                "function argument ", arg.name, " defined twice")
-        check_vardecl(arg, structs)
-        argnames.add(arg.name)
-    body_type = check(func.stmt, structs)
-    if body_type != func.type:
+        check_vardecl(arg, types)
+    body_type = check(func.stmt, types, type_cache)
+    if body_type is not ret_type:
         raise SemanticsException(func.type.line,
             "return type mismatch or missing return statement")
 
-@check.register(astnode.BlockStatement)
-def check_block(block, structs, scope=set()):
+@register(astnode.BlockStatement)
+def check_block(block, types, type_cache, scope=frozenset()):
     func_ret = None
     for stmt in block.stmts:
-        ret = check(stmt, structs, scope)
-        if ret != None:
-            if func_ret == None:
-                func_ret = ret
-            elif func_ret != ret:
-                raise SemanticsException(stmt.line, "return type mismatch")
+        ret = check(stmt, types, type_cache, scope)
+        if ret is None:
+            continue
+        if func_ret is None:
+            func_ret = ret
+        # type keys are interned, see type_key
+        elif func_ret is not ret:
+            raise SemanticsException(stmt.line, "return type mismatch")
     return func_ret
+
+@register(astnode.WhileStatement)
+def check_while(stmt, types, type_cache, scope=frozenset()):
+    return check(stmt.stmt, types, type_cache, scope)
+
+@register(astnode.IfStatement)
+def check_if(stmt, types, type_cache, scope=frozenset()):
+    ret = check(stmt.stmt, types, type_cache, scope)
+    if stmt.elsestmt is None:
+        return ret
+    else_ret = check(stmt.elsestmt, types, type_cache, scope)
+    if ret is None:
+        return else_ret
+    # type keys are interned, see type_key
+    if else_ret is not None and else_ret is not ret:
+        raise SemanticsException(stmt.elsestmt.line, "return type mismatch")
+    return ret
+
+def check_unchecked(stmt, *args):
+    """Placeholder for statements that aren't checked yet."""
+    # None, like a statement that doesn't return anything
+    return None
+
+# statements with no statements nested in them
+for node_type in (astnode.CtrlStatement, astnode.RetStatement,
+        astnode.StoreStatement, astnode.StructStoreStatement,
+        astnode.AssignStatement, astnode.FCallStatement):
+    register(node_type)(check_unchecked)